@@ -10,8 +10,9 @@ import { ChromaClient } from "chromadb";
 // Configuration
 const COLLECTION_NAME = "experience_store";
 const DB_PATH = "./chroma_db";
-const EMBEDDING_MODEL = "models/embedding-001";
+const EMBEDDING_MODEL = process.env.GEMINI_EMBED_MODEL || "models/embedding-001";
 const DEFAULT_TOP_K = 5;
+const STAR_BY_ID_FILE = "star_by_id.json"; // Written by ingest.py next to the ChromaDB data
 
 /**
  * Dummy embedding function for ChromaDB client
@@ -83,6 +84,35 @@ async function generateQueryEmbedding(query: string, apiKey: string): Promise<nu
   }
 }
 
+/**
+ * STAR format text per experience_id, with the file mtime it was read at
+ */
+let starByIdCache: { mtimeMs: number; starById: Record<string, string> } | null = null;
+
+/**
+ * Load the STAR format text for every experience.
+ * ingest.py stores it once per experience instead of on every chunk's metadata.
+ * The file is re-read whenever a later ingest rewrites it.
+ */
+async function loadStarById(): Promise<Record<string, string>> {
+  try {
+    const fs = await import("fs/promises");
+    const path = await import("path");
+    const starPath = path.join(process.cwd(), DB_PATH, STAR_BY_ID_FILE);
+    const { mtimeMs } = await fs.stat(starPath);
+    if (starByIdCache && starByIdCache.mtimeMs === mtimeMs) {
+      return starByIdCache.starById;
+    }
+
+    const data = await fs.readFile(starPath, "utf-8");
+    starByIdCache = { mtimeMs, starById: JSON.parse(data) as Record<string, string> };
+    return starByIdCache.starById;
+  } catch (error: any) {
+    console.warn(`⚠️  Could not load ${STAR_BY_ID_FILE}:`, error.message);
+    return starByIdCache ? starByIdCache.starById : {};
+  }
+}
+
 /**
  * Fallback: Load experiences from JSON file when ChromaDB is not available
  */
@@ -210,6 +240,7 @@ export async function getRelevantExperiences(
     }
 
     // Extract results and deduplicate by experience_id
+    const starById = await loadStarById();
     const chunks: RelevantChunk[] = [];
     const seenExperienceIds = new Set<number>();
 
@@ -246,7 +277,7 @@ export async function getRelevantExperiences(
           company: metadata.company || "Unknown",
           chunk_index: metadata.chunk_index || 0,
           total_chunks: metadata.total_chunks || 1,
-          star_format: metadata.star_format || "",
+          star_format: starById[String(experienceId)] || metadata.star_format || "",
         },
         score: distance !== undefined ? 1 - distance : undefined, // Convert distance to similarity score
       });
@@ -319,6 +350,7 @@ export async function getRelevantExperiencesStructured(
       nResults: Math.min(topK * 3, await collection.count()),
     });
 
+    const starById = await loadStarById();
     const chunks: RelevantChunk[] = [];
     const seenExperienceIds = new Set<number>();
 
@@ -345,7 +377,7 @@ export async function getRelevantExperiencesStructured(
             company: metadata?.company || "Unknown",
             chunk_index: metadata?.chunk_index || 0,
             total_chunks: metadata?.total_chunks || 1,
-            star_format: metadata?.star_format || "",
+            star_format: starById[String(experienceId)] || metadata?.star_format || "",
           },
           score: queryResults.distances?.[0]?.[i] !== undefined 
             ? 1 - (queryResults.distances?.[0]?.[i] as number)
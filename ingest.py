@@ -15,39 +15,58 @@ import sys
 from pathlib import Path
 
 try:
-    import google.generativeai as genai
+    import numpy as np
     import chromadb
     from chromadb.config import Settings
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from ingest_utils import (
+        CHUNK_OVERLAP,
+        CHUNK_SIZE,
+        INGEST_FLUSH_SIZE,
+        TEXT_SPLITTER,
+        add_to_collection,
+        count_json_array,
+        embed_and_store,
+        iter_chunk_rows,
+        iter_json_array,
+        mean_pool,
+        write_atomic,
+        write_vector_index,
+    )
 except ImportError as e:
     print(f"❌ Missing required package: {e}")
     print("Please install dependencies: pip install -r requirements.txt")
     sys.exit(1)
 
 
-def load_experiences(json_path: str = "experiences.json"):
-    """Load experiences from JSON file."""
-    try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            experiences = json.load(f)
-        print(f"✅ Loaded {len(experiences)} experiences from {json_path}")
-        return experiences
-    except FileNotFoundError:
+SUMMARY_COLLECTION_NAME = "experience_summary"
+
+
+def iter_experiences(json_path: str = "experiences.json"):
+    """
+    Stream experiences from JSON file one at a time.
+    
+    Returns:
+        Tuple of (number of experiences in the file, iterator over them)
+    """
+    if not os.path.exists(json_path):
         print(f"❌ Error: {json_path} not found")
         sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"❌ Error parsing JSON: {e}")
-        sys.exit(1)
+    
+    # One streaming validation pass up front, like the old json.load, so a
+    # parse error exits before the collection is recreated
+    count = count_json_array(json_path)
+    print(f"✅ Streaming {count} experiences from {json_path}")
+    return count, iter_json_array(json_path)
 
 
-def chunk_description(description: str, chunk_size: int = 300, chunk_overlap: int = 50):
+def chunk_description(description: str):
     """
     Chunk the description field into smaller pieces.
     
+    Uses the shared TEXT_SPLITTER built from CHUNK_SIZE and CHUNK_OVERLAP.
+    
     Args:
         description: The description text to chunk
-        chunk_size: Maximum size of each chunk (default: 300)
-        chunk_overlap: Overlap between chunks (default: 50)
     
     Returns:
         List of text chunks
@@ -55,43 +74,12 @@ def chunk_description(description: str, chunk_size: int = 300, chunk_overlap: in
     if not description or len(description.strip()) == 0:
         return [description] if description else [""]
     
-    # Initialize text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
+    # Short descriptions fit in a single chunk; skip the splitter (stripped
+    # like the splitter's output so chunk text and cache keys are unchanged)
+    if len(description) <= CHUNK_SIZE:
+        return [description.strip()]
     
-    # Split the description
-    chunks = text_splitter.split_text(description)
-    return chunks
-
-
-def get_embedding(text: str, api_key: str) -> list:
-    """Generate embedding using Gemini's embedding model."""
-    genai.configure(api_key=api_key)
-    
-    try:
-        # Use Gemini's embedding model
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
-    except Exception as e:
-        print(f"❌ Error generating embedding: {e}")
-        # Try alternative API format
-        try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=text
-            )
-            return result['embedding']
-        except Exception as e2:
-            print(f"❌ Alternative embedding API also failed: {e2}")
-            raise
+    return TEXT_SPLITTER.split_text(description)
 
 
 def create_star_format_text(experience: dict) -> str:
@@ -107,6 +95,47 @@ Result: "{experience['result']}"
 """
 
 
+def build_chunk_rows(exp: dict) -> list:
+    """
+    Chunk one experience into (chunk_id, chunk_text, metadata) rows.
+    
+    Args:
+        exp: The experience to chunk
+    
+    Returns:
+        List of rows, one per chunk
+    """
+    # Chunk the description field
+    description_chunks = chunk_description(exp.get('description', ''))
+    
+    if not description_chunks or (len(description_chunks) == 1 and not description_chunks[0].strip()):
+        # If no description or empty, use a single chunk with full experience text
+        description_chunks = [
+            f"Title: {exp['title']}\nCompany: {exp['company']}\n"
+            f"Situation: {exp.get('situation', '')}\n"
+            f"Task: {exp.get('task', '')}\n"
+            f"Action: {exp.get('action', '')}\n"
+            f"Result: {exp.get('result', '')}"
+        ]
+    else:
+        # Prepend title and company to each chunk for better context
+        description_chunks = [
+            f"Title: {exp['title']}\nCompany: {exp['company']}\nDescription: {chunk}"
+            for chunk in description_chunks
+        ]
+    
+    return [
+        (f"exp_{exp['id']}_chunk_{chunk_idx}", chunk_text, {
+            "experience_id": exp['id'],
+            "title": exp['title'],
+            "company": exp['company'],
+            "chunk_index": chunk_idx,
+            "total_chunks": len(description_chunks),
+        })
+        for chunk_idx, chunk_text in enumerate(description_chunks)
+    ]
+
+
 def main():
     """Main ingestion function."""
     # Check for API key
@@ -116,8 +145,8 @@ def main():
         print("Please set it: export GEMINI_API_KEY='your-api-key'")
         sys.exit(1)
     
-    # Load experiences
-    experiences = load_experiences()
+    # Stream experiences instead of loading the whole file
+    total_experiences, experiences = iter_experiences()
     
     # Initialize ChromaDB
     # Store vector DB in ./chroma_db directory
@@ -148,98 +177,102 @@ def main():
         print(f"✅ Created new collection: {collection_name}")
     
     # Initialize text splitter for chunking
-    print("\n📝 Chunking descriptions (chunk_size=300, overlap=50)...")
+    print(f"\n📝 Chunking descriptions (chunk_size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP})...")
     
     # Process each experience
-    print(f"\n🔄 Processing {len(experiences)} experiences...")
-    
-    ids = []
-    embeddings = []
-    documents = []
-    metadatas = []
+    print(f"\n🔄 Processing {total_experiences} experiences...")
     
-    chunk_count = 0
+    # Pending (chunk_id, chunk_text, metadata) rows, embedded and stored every
+    # INGEST_FLUSH_SIZE chunks so memory stays flat regardless of file size
+    pending = []
+    stored_count = 0
+    experience_count = 0
+    # STAR text is stored once per experience, not on every chunk's metadata
+    star_by_id = {}
+    # experience_id -> (mean-pooled embedding, metadata) for the summary collection
+    summaries = {}
     
-    for i, exp in enumerate(experiences, 1):
-        print(f"   Processing {i}/{len(experiences)}: {exp['title']}...")
-        
-        # Chunk the description field
-        description_chunks = chunk_description(exp.get('description', ''))
-        
-        if not description_chunks or (len(description_chunks) == 1 and not description_chunks[0].strip()):
-            # If no description or empty, use a single chunk with full experience text
-            print(f"      ⚠️  No description found, using full experience text")
-            description_chunks = [
-                f"Title: {exp['title']}\nCompany: {exp['company']}\n"
-                f"Situation: {exp.get('situation', '')}\n"
-                f"Task: {exp.get('task', '')}\n"
-                f"Action: {exp.get('action', '')}\n"
-                f"Result: {exp.get('result', '')}"
-            ]
-        else:
-            # Prepend title and company to each chunk for better context
-            description_chunks = [
-                f"Title: {exp['title']}\nCompany: {exp['company']}\nDescription: {chunk}"
-                for chunk in description_chunks
-            ]
+    def flush():
+        nonlocal stored_count
+        metadatas, embeddings = embed_and_store(collection, pending, api_key)
+        stored_count += len(metadatas)
+        if not metadatas:
+            return
         
-        # Process each chunk
-        for chunk_idx, chunk_text in enumerate(description_chunks):
-            chunk_id = f"exp_{exp['id']}_chunk_{chunk_idx}"
-            
-            # Generate embedding for this chunk
-            try:
-                embedding = get_embedding(chunk_text, api_key)
-            except Exception as e:
-                print(f"      ❌ Failed to generate embedding for chunk {chunk_idx}: {e}")
-                continue
-            
-            # Store data with metadata
-            ids.append(chunk_id)
-            embeddings.append(embedding)
-            documents.append(chunk_text)
-            metadatas.append({
-                "experience_id": exp['id'],
-                "title": exp['title'],
-                "company": exp['company'],
-                "chunk_index": chunk_idx,
-                "total_chunks": len(description_chunks),
-                "star_format": create_star_format_text(exp)  # Store full STAR format for retrieval
+        # Rows are flushed on experience boundaries, so each experience's
+        # chunks are pooled together
+        experience_ids, pooled = mean_pool(
+            [metadata['experience_id'] for metadata in metadatas], embeddings
+        )
+        first_chunk = {}
+        for metadata in metadatas:
+            first_chunk.setdefault(metadata['experience_id'], metadata)
+        for experience_id, vector in zip(experience_ids, pooled):
+            summaries[experience_id] = (vector, {
+                "experience_id": experience_id,
+                "title": first_chunk[experience_id]['title'],
+                "company": first_chunk[experience_id]['company'],
             })
-            chunk_count += 1
-        
-        print(f"      ✅ Created {len(description_chunks)} chunk(s) for this experience")
     
-    # Batch add to ChromaDB
-    if ids:
-        print(f"\n💾 Storing {len(ids)} chunks in ChromaDB collection '{collection_name}'...")
+    # Chunking runs in worker processes while this process embeds and stores
+    chunked = iter_chunk_rows(build_chunk_rows, ((exp,) for exp in experiences))
+    for i, ((exp,), rows) in enumerate(chunked, 1):
+        print(f"   Processing {i}/{total_experiences}: {exp['title']}...")
+        # Reported here rather than in build_chunk_rows, which runs in a worker
+        if not (exp.get('description') or '').strip():
+            print("      ⚠️  No description found, using full experience text")
         
-        # ChromaDB has a limit on batch size, so we'll process in batches
-        batch_size = 100
-        total_batches = (len(ids) + batch_size - 1) // batch_size
+        pending.extend(rows)
+        star_by_id[exp['id']] = create_star_format_text(exp)
+        experience_count += 1
         
-        for batch_idx in range(total_batches):
-            start_idx = batch_idx * batch_size
-            end_idx = min((batch_idx + 1) * batch_size, len(ids))
-            
-            batch_ids = ids[start_idx:end_idx]
-            batch_embeddings = embeddings[start_idx:end_idx]
-            batch_documents = documents[start_idx:end_idx]
-            batch_metadatas = metadatas[start_idx:end_idx]
-            
-            collection.add(
-                ids=batch_ids,
-                embeddings=batch_embeddings,
-                documents=batch_documents,
-                metadatas=batch_metadatas
-            )
-            
-            print(f"   ✅ Stored batch {batch_idx + 1}/{total_batches} ({len(batch_ids)} chunks)")
+        print(f"      ✅ Created {len(rows)} chunk(s) for this experience")
         
-        print(f"\n✅ Successfully ingested {len(ids)} chunks from {len(experiences)} experiences!")
+        if len(pending) >= INGEST_FLUSH_SIZE:
+            flush()
+            pending = []
+    
+    if pending:
+        flush()
+    
+    # One mean-pooled embedding per experience, so retrieval can ask for
+    # exactly top_k experiences instead of over-fetching chunks to dedupe.
+    # Written even when nothing was embedded, so the summaries, shadow index
+    # and STAR map never outlive the experience_store they were built from.
+    print(f"\n💾 Storing experience summaries in ChromaDB collection '{SUMMARY_COLLECTION_NAME}'...")
+    experience_ids = list(summaries)
+    summary_ids = [f"exp_{experience_id}" for experience_id in experience_ids]
+    summary_embeddings = (
+        np.stack([summaries[experience_id][0] for experience_id in experience_ids])
+        if experience_ids else np.zeros((0, 0), dtype=np.float32)
+    )
+    summary_documents = [star_by_id[experience_id] for experience_id in experience_ids]
+    summary_metadatas = [summaries[experience_id][1] for experience_id in experience_ids]
+    
+    try:
+        client.delete_collection(name=SUMMARY_COLLECTION_NAME)
+    except Exception:
+        pass
+    summary_collection = client.create_collection(name=SUMMARY_COLLECTION_NAME)
+    add_to_collection(
+        summary_collection, summary_ids, summary_embeddings, summary_documents, summary_metadatas
+    )
+    write_vector_index(
+        db_path, "experience_index", summary_ids, summary_embeddings, summary_metadatas
+    )
+    
+    # Full STAR format for retrieval, keyed by experience_id (only experiences
+    # that made it into the collection)
+    star_payload = json.dumps(
+        {experience_id: star_by_id[experience_id] for experience_id in experience_ids}
+    ).encode("utf-8")
+    write_atomic(db_path / "star_by_id.json", lambda f: f.write(star_payload))
+    
+    if summaries:
+        print(f"\n✅ Successfully ingested {stored_count} chunks from {experience_count} experiences!")
         print(f"   Collection name: {collection_name}")
         print(f"   Database location: {db_path.absolute()}")
-        print(f"   Average chunks per experience: {len(ids) / len(experiences):.2f}")
+        print(f"   Average chunks per experience: {stored_count / experience_count:.2f}")
     else:
         print("❌ No chunks were successfully processed")
 
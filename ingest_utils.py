@@ -0,0 +1,621 @@
+"""
+Shared helpers for the ingestion scripts (ingest.py, ingest_technical_qa.py).
+
+Embeddings are requested from Gemini in batches instead of one HTTP
+round-trip per chunk, with several batches in flight at once. Setting
+GEMINI_USE_BATCH_API=1 submits them as an offline Gemini Batch API job
+instead (half price, higher rate limits, up to 24h turnaround). Chunks
+whose text was embedded before are served from an on-disk cache.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+import random
+import sqlite3
+import sys
+import time
+
+try:
+    import ijson
+    import httpx
+    import numpy as np
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+except ImportError as e:
+    print(f"❌ Missing required package: {e}")
+    print("Please install dependencies: pip install -r requirements.txt")
+    sys.exit(1)
+
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+EMBEDDING_MODEL = os.getenv("GEMINI_EMBED_MODEL", "models/embedding-001")
+EMBED_BATCH_SIZE = 100  # Gemini accepts at most 100 texts per batch embed call
+MAX_CONCURRENT_REQUESTS = 8  # Batches in flight at once, kept under the RPM limit
+MAX_RETRIES = 5  # Retries on 429 before a batch is given up
+MAX_KEEPALIVE_CONNECTIONS = 32  # Pooled HTTP/2 connections shared by all batches
+
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+
+# Built once and shared by both ingestion scripts so their chunking can't drift apart
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    separators=["\n\n", "\n", ". ", " ", ""]
+)
+
+INGEST_FLUSH_SIZE = 1000  # Pending chunks embedded and stored together while streaming input
+ADD_BATCH_SIZE = 500  # Chunks per collection.add call (well under ChromaDB's max batch size)
+ADD_MAX_WORKERS = 4  # collection.add calls in flight at once
+CHUNK_MAX_WORKERS = os.cpu_count() or 1  # Processes chunking input items
+CHUNK_TASK_SIZE = 64  # Input items chunked per worker task, to amortize pickling
+CHUNK_READ_AHEAD = 256  # Input items read ahead of the caller, regardless of core count
+
+EMBEDDING_CACHE_PATH = Path("./chroma_db") / "embedding_cache.sqlite"
+CACHE_LOOKUP_BATCH_SIZE = 500  # Hashes per SELECT, under SQLite's bound-parameter limit
+
+BATCH_REQUESTS_PATH = "embedding_requests.jsonl"
+BATCH_POLL_INTERVAL = 30  # Seconds between Batch API job status checks
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+
+def iter_json_array(json_path: str):
+    """Yield the items of a top-level JSON array one at a time, without loading the whole file."""
+    try:
+        with open(json_path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+    except ijson.JSONError as e:
+        print(f"❌ Error parsing JSON: {e}")
+        sys.exit(1)
+
+
+def count_json_array(json_path: str) -> int:
+    """
+    Validate a JSON array file in one streaming pass and return its item count.
+
+    Run before touching ChromaDB so a malformed file exits without leaving a
+    partially rebuilt collection behind. Exits on parse errors like
+    iter_json_array.
+    """
+    return sum(1 for _ in iter_json_array(json_path))
+
+
+def _build_rows_batch(build_rows, arg_tuples: list) -> list:
+    """Run build_rows over a batch of argument tuples (executed in a worker process)."""
+    return [build_rows(*args) for args in arg_tuples]
+
+
+def iter_chunk_rows(
+    build_rows,
+    arg_tuples,
+    max_workers: int = CHUNK_MAX_WORKERS,
+    task_size: int = CHUNK_TASK_SIZE,
+    read_ahead: int = CHUNK_READ_AHEAD,
+):
+    """
+    Chunk input items in a process pool while the caller embeds and stores.
+
+    At most read_ahead items are submitted and not yet yielded, so a
+    streamed input is never read far ahead of the caller however many
+    cores there are. Tasks shrink below task_size when needed to keep every
+    worker busy within that budget. Results are yielded in input order.
+
+    Args:
+        build_rows: Module-level function returning the chunk rows for one item
+        arg_tuples: Iterable of argument tuples for build_rows
+        max_workers: Worker processes (default: os.cpu_count())
+        task_size: Maximum items per worker task (default: 64)
+        read_ahead: Maximum items in flight (default: 256)
+
+    Yields:
+        Tuples of (argument tuple, rows returned by build_rows)
+    """
+    arg_tuples = iter(arg_tuples)
+    task_size = max(1, min(task_size, read_ahead // max_workers))
+    in_flight = deque()
+    in_flight_items = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while in_flight_items + task_size <= read_ahead:
+                batch = list(itertools.islice(arg_tuples, task_size))
+                if not batch:
+                    break
+                in_flight.append((batch, executor.submit(_build_rows_batch, build_rows, batch)))
+                in_flight_items += len(batch)
+            if not in_flight:
+                return
+
+            batch, future = in_flight.popleft()
+            in_flight_items -= len(batch)
+            yield from zip(batch, future.result())
+
+
+class RateLimitError(Exception):
+    """Gemini answered 429; the caller should back off and retry."""
+
+
+async def post_batch_embed(client, body: dict) -> list:
+    """POST a batchEmbedContents request and return one embedding per text."""
+    response = await client.post(
+        f"{GEMINI_API_BASE}/{EMBEDDING_MODEL}:batchEmbedContents", json=body
+    )
+    if response.status_code == 429:
+        raise RateLimitError(response.text)
+    response.raise_for_status()
+    return [item['values'] for item in response.json()['embeddings']]
+
+
+async def embed_batch(client, texts: list):
+    """
+    Generate embeddings for a list of texts with a single Gemini call.
+
+    Returns:
+        Tuple of (one embedding per text, whether they were generated with
+        the RETRIEVAL_DOCUMENT task type)
+    """
+    requests = [
+        {"model": EMBEDDING_MODEL, "content": {"parts": [{"text": text}]}}
+        for text in texts
+    ]
+    try:
+        return await post_batch_embed(client, {
+            "requests": [{**request, "taskType": "RETRIEVAL_DOCUMENT"} for request in requests]
+        }), True
+    except httpx.HTTPStatusError as e:
+        # Only a rejected request (4xx) suggests the model doesn't take a task
+        # type; timeouts and 5xx fail the batch so it is retried on the next run
+        if not 400 <= e.response.status_code < 500:
+            raise
+        print(f"❌ Error generating embeddings: {e}")
+        # Try alternative API format
+        try:
+            return await post_batch_embed(client, {"requests": requests}), False
+        except Exception as e2:
+            print(f"❌ Alternative embedding API also failed: {e2}")
+            raise
+
+
+async def embed_batch_with_backoff(client, texts: list, semaphore: asyncio.Semaphore):
+    """Embed one batch, retrying with exponential backoff when rate limited (429)."""
+    delay = 1.0
+    for attempt in range(MAX_RETRIES + 1):
+        async with semaphore:
+            try:
+                return await embed_batch(client, texts)
+            except RateLimitError:
+                if attempt == MAX_RETRIES:
+                    raise
+
+        # Sleep outside the semaphore so other batches can use the slot
+        wait = delay + random.uniform(0, delay)
+        print(f"   ⏳ Rate limited, retrying in {wait:.1f}s...")
+        await asyncio.sleep(wait)
+        delay *= 2
+
+
+async def embed_documents_async(
+    texts: list,
+    api_key: str,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+):
+    """Async implementation of embed_documents."""
+    semaphore = asyncio.Semaphore(max_concurrent)
+    total_batches = (len(texts) + batch_size - 1) // batch_size
+
+    # Allocated once the first batch returns and reveals the embedding dimension
+    embeddings = None
+    embedded = np.zeros(len(texts), dtype=bool)
+    with_task_type = np.zeros(len(texts), dtype=bool)
+
+    async def bounded(client, batch_idx: int):
+        nonlocal embeddings
+        start_idx = batch_idx * batch_size
+        end_idx = min(start_idx + batch_size, len(texts))
+
+        try:
+            batch_embeddings, batch_with_task_type = await embed_batch_with_backoff(
+                client, texts[start_idx:end_idx], semaphore
+            )
+        except Exception as e:
+            print(f"   ❌ Failed to embed batch {batch_idx + 1}/{total_batches}: {e}")
+            return
+
+        if embeddings is None:
+            embeddings = new_embedding_matrix(len(texts), len(batch_embeddings[0]))
+        embeddings[start_idx:end_idx] = np.asarray(batch_embeddings, dtype=np.float32)
+        embedded[start_idx:end_idx] = True
+        with_task_type[start_idx:end_idx] = batch_with_task_type
+        print(f"   ✅ Embedded batch {batch_idx + 1}/{total_batches} ({end_idx - start_idx} chunks)")
+
+    # One HTTP/2 client for the whole run so batches reuse keep-alive
+    # connections instead of paying a TLS handshake each
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+        headers={"x-goog-api-key": api_key},
+        timeout=60.0,
+    ) as client:
+        await asyncio.gather(*[bounded(client, i) for i in range(total_batches)])
+
+    if embeddings is None:
+        embeddings = new_embedding_matrix(len(texts), 0)
+    return embeddings, embedded, with_task_type
+
+
+def embed_documents(
+    texts: list,
+    api_key: str,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+):
+    """
+    Generate embeddings for all texts, batch_size texts per API call.
+
+    Batches are sent concurrently, at most max_concurrent at a time.
+
+    Args:
+        texts: The chunk texts to embed
+        api_key: Gemini API key
+        batch_size: Number of texts sent per request (default: 100)
+        max_concurrent: Maximum number of requests in flight (default: 8)
+
+    Returns:
+        Tuple of (float32 array with one row per text, boolean mask of the
+        rows that were embedded successfully, boolean mask of the rows
+        embedded with the RETRIEVAL_DOCUMENT task type)
+    """
+    return asyncio.run(embed_documents_async(texts, api_key, batch_size, max_concurrent))
+
+
+def new_embedding_matrix(count: int, dimension: int):
+    """Preallocate a float32 matrix for count embeddings."""
+    return np.zeros((count, dimension), dtype=np.float32)
+
+
+def use_batch_api() -> bool:
+    """Whether embeddings should go through the Gemini Batch API."""
+    return os.getenv("GEMINI_USE_BATCH_API", "").strip().lower() in ("1", "true", "yes")
+
+
+def embed_documents_batch_job(keys: list, texts: list, api_key: str) -> list:
+    """
+    Generate embeddings for all texts with a single Gemini Batch API job.
+
+    Args:
+        keys: Unique key per text (the chunk id), used to match results back
+        texts: The chunk texts to embed
+        api_key: Gemini API key
+
+    Returns:
+        Tuple of (float32 array with one row per text, boolean mask of the
+        rows the job returned an embedding for)
+    """
+    try:
+        from google import genai as genai_sdk
+    except ImportError as e:
+        print(f"❌ Missing required package for the Batch API: {e}")
+        print("Please install it: pip install google-genai")
+        sys.exit(1)
+
+    client = genai_sdk.Client(api_key=api_key)
+
+    # 1. Write one embedding request per chunk
+    with open(BATCH_REQUESTS_PATH, "w", encoding="utf-8") as f:
+        for key, text in zip(keys, texts):
+            f.write(json.dumps({
+                "key": key,
+                "request": {
+                    "content": {"parts": [{"text": text}]},
+                    "task_type": "RETRIEVAL_DOCUMENT",
+                },
+            }) + "\n")
+
+    # 2. Upload the requests and submit the job
+    uploaded = client.files.upload(
+        file=BATCH_REQUESTS_PATH,
+        config={"display_name": "embedding-requests", "mime_type": "jsonl"},
+    )
+    job = client.batches.create_embeddings(
+        model=EMBEDDING_MODEL,
+        src={"file_name": uploaded.name},
+        config={"display_name": "embedding-ingest"},
+    )
+    print(f"   📨 Submitted Batch API job {job.name} ({len(texts)} chunks)")
+
+    # 3. Poll until the job finishes
+    while job.state.name not in BATCH_DONE_STATES:
+        print(f"   ⏳ Job state: {job.state.name}, checking again in {BATCH_POLL_INTERVAL}s...")
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = client.batches.get(name=job.name)
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch API job {job.name} finished with state {job.state.name}")
+
+    # 4. Download the results and match them back by key
+    content = client.files.download(file=job.dest.file_name).decode("utf-8")
+    row_by_key = {key: i for i, key in enumerate(keys)}
+    embeddings = None
+    embedded = np.zeros(len(texts), dtype=bool)
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        values = item.get("response", {}).get("embedding", {}).get("values")
+        if values is None:
+            print(f"   ❌ No embedding returned for {item.get('key')}: {item.get('error')}")
+            continue
+
+        if embeddings is None:
+            embeddings = new_embedding_matrix(len(texts), len(values))
+        row = row_by_key[item["key"]]
+        embeddings[row] = values
+        embedded[row] = True
+
+    if embeddings is None:
+        embeddings = new_embedding_matrix(len(texts), 0)
+    print(f"   ✅ Batch API job returned {int(embedded.sum())}/{len(texts)} embeddings")
+    return embeddings, embedded
+
+
+class EmbeddingCache:
+    """
+    On-disk map from sha256(model + chunk text) to its float32 embedding.
+
+    Lets repeated ingests skip the Gemini API for chunks whose text has not
+    changed. The model name is part of the key so switching
+    GEMINI_EMBED_MODEL never serves vectors from another model.
+    """
+
+    def __init__(self, path: Path = EMBEDDING_CACHE_PATH):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Cache key for a chunk text under the current embedding model."""
+        return hashlib.sha256(f"{EMBEDDING_MODEL}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes: list) -> dict:
+        """Return {hash: embedding} for the hashes present in the cache."""
+        found = {}
+        for start_idx in range(0, len(hashes), CACHE_LOOKUP_BATCH_SIZE):
+            batch = hashes[start_idx:start_idx + CACHE_LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE hash IN ({placeholders})", batch
+            )
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, items: dict):
+        """Store {hash: embedding} pairs."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (hash, vector) VALUES (?, ?)",
+            [(text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in items.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def embed_uncached(ids: list, texts: list, api_key: str):
+    """
+    Generate embeddings through the Gemini API, bypassing the cache.
+
+    Uses the Batch API when GEMINI_USE_BATCH_API is set, otherwise the
+    concurrent synchronous API.
+
+    Returns:
+        Tuple of (float32 array with one row per text, boolean mask of the
+        rows that were embedded successfully, boolean mask of the rows
+        embedded with the RETRIEVAL_DOCUMENT task type)
+    """
+    if not use_batch_api():
+        return embed_documents(texts, api_key)
+
+    try:
+        # Batch API requests always carry the task type
+        embeddings, embedded = embed_documents_batch_job(ids, texts, api_key)
+        return embeddings, embedded, embedded
+    except Exception as e:
+        print(f"   ❌ Batch API embedding failed: {e}")
+        failed = np.zeros(len(texts), dtype=bool)
+        return new_embedding_matrix(len(texts), 0), failed, failed
+
+
+def embed_chunks(ids: list, texts: list, api_key: str):
+    """
+    Generate embeddings for the chunks of an ingestion run.
+
+    Chunks are deduplicated by content hash: texts already in the
+    EmbeddingCache (or repeated within this run) are not sent to Gemini,
+    and new embeddings are added to the cache. Embeddings from the fallback
+    request without a task type are used for this run but not cached.
+
+    Returns:
+        Tuple of (float32 array with one row per text, boolean mask of the
+        rows that were embedded successfully)
+    """
+    cache = EmbeddingCache()
+    try:
+        hashes = [EmbeddingCache.hash_text(text) for text in texts]
+        known = cache.get_many(list(set(hashes)))
+
+        # First occurrence of every hash the cache doesn't have yet
+        missing = {}
+        for i, text_hash in enumerate(hashes):
+            if text_hash not in known and text_hash not in missing:
+                missing[text_hash] = i
+        print(f"   ♻️  {len(texts) - len(missing)}/{len(texts)} chunks served from the embedding cache")
+
+        if missing:
+            rows = list(missing.values())
+            fresh, fresh_ok, fresh_cacheable = embed_uncached(
+                [ids[i] for i in rows], [texts[i] for i in rows], api_key
+            )
+            new_items = {
+                hashes[row]: fresh[j] for j, row in enumerate(rows) if fresh_ok[j]
+            }
+            cache.put_many({
+                hashes[row]: fresh[j] for j, row in enumerate(rows) if fresh_cacheable[j]
+            })
+            known.update(new_items)
+    finally:
+        cache.close()
+
+    dimension = len(next(iter(known.values()))) if known else 0
+    embeddings = new_embedding_matrix(len(texts), dimension)
+    embedded = np.zeros(len(texts), dtype=bool)
+    for i, text_hash in enumerate(hashes):
+        vector = known.get(text_hash)
+        if vector is not None:
+            embeddings[i] = vector
+            embedded[i] = True
+    return embeddings, embedded
+
+
+def add_to_collection(
+    collection,
+    ids: list,
+    embeddings,
+    documents: list,
+    metadatas: list,
+    batch_size: int = ADD_BATCH_SIZE,
+    max_workers: int = ADD_MAX_WORKERS,
+):
+    """
+    Store chunks in a ChromaDB collection in batches.
+
+    Batches are added from a small thread pool so the SQLite/HNSW writes of
+    one batch overlap with preparing the next.
+
+    Args:
+        collection: The ChromaDB collection to add to
+        ids: Chunk ids
+        embeddings: float32 array with one row per chunk
+        documents: Chunk texts
+        metadatas: Chunk metadata dicts
+        batch_size: Chunks per collection.add call (default: 500)
+        max_workers: Concurrent collection.add calls (default: 4)
+    """
+    total_batches = (len(ids) + batch_size - 1) // batch_size
+
+    def add_batch(start_idx: int, end_idx: int) -> int:
+        collection.add(
+            ids=ids[start_idx:end_idx],
+            embeddings=embeddings[start_idx:end_idx].tolist(),  # ChromaDB expects lists
+            documents=documents[start_idx:end_idx],
+            metadatas=metadatas[start_idx:end_idx]
+        )
+        return end_idx - start_idx
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(add_batch, start_idx, min(start_idx + batch_size, len(ids)))
+            for start_idx in range(0, len(ids), batch_size)
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            print(f"   ✅ Stored batch {done}/{total_batches} ({future.result()} chunks)")
+
+
+def embed_and_store(collection, rows: list, api_key: str):
+    """
+    Embed (chunk_id, chunk_text, metadata) rows and add them to a collection.
+
+    Returns:
+        Tuple of (metadatas, float32 embeddings) for the rows that were stored
+    """
+    print(f"\n🧠 Generating embeddings for {len(rows)} chunks...")
+    row_embeddings, embedded = embed_chunks(
+        [chunk_id for chunk_id, _, _ in rows],
+        [chunk_text for _, chunk_text, _ in rows],
+        api_key,
+    )
+
+    # Keep only the chunks that were embedded; embeddings stay a float32 array
+    keep = np.flatnonzero(embedded)
+    ids = [rows[i][0] for i in keep]
+    documents = [rows[i][1] for i in keep]
+    metadatas = [rows[i][2] for i in keep]
+    embeddings = row_embeddings[keep]
+
+    if ids:
+        print(f"💾 Storing {len(ids)} chunks in ChromaDB collection '{collection.name}'...")
+        add_to_collection(collection, ids, embeddings, documents, metadatas)
+    return metadatas, embeddings
+
+
+def normalize_rows(embeddings):
+    """L2-normalize each row of a float32 embedding matrix."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def mean_pool(groups: list, embeddings):
+    """
+    Average the L2-normalized rows that share a group key.
+
+    Args:
+        groups: Group key per row (e.g. experience_id)
+        embeddings: float32 array with one row per key in groups
+
+    Returns:
+        Tuple of (unique keys in first-seen order, L2-normalized mean per key)
+    """
+    keys = list(dict.fromkeys(groups))
+    position = {key: i for i, key in enumerate(keys)}
+    sums = new_embedding_matrix(len(keys), embeddings.shape[1])
+    np.add.at(sums, [position[group] for group in groups], normalize_rows(embeddings))
+    return keys, normalize_rows(sums)
+
+
+def write_atomic(path, write) -> None:
+    """
+    Write a file through a temp file and os.replace it into place.
+
+    Readers (rag_api.py, the Next.js routes) only ever see the old or the new
+    file, never a truncated one.
+
+    Args:
+        path: Destination Path
+        write: Callable that writes the content to a binary file object
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_vector_index(db_path, name: str, ids: list, embeddings, metadatas: list):
+    """
+    Write a NumPy shadow copy of a collection next to ChromaDB.
+
+    The L2-normalized rows are stored as float16 (<name>.npy), half the
+    size of float32; rag_api.py upcasts them once on load and scores them
+    with a single float32 matrix-vector product. <name>.json holds the
+    matching ids and metadatas and is replaced last, so its mtime marks a
+    complete index. ChromaDB remains the persistent store.
+    """
+    vectors = normalize_rows(embeddings).astype(np.float16)
+    write_atomic(db_path / f"{name}.npy", lambda f: np.save(f, vectors))
+    payload = json.dumps({"ids": ids, "metadatas": metadatas}).encode("utf-8")
+    write_atomic(db_path / f"{name}.json", lambda f: f.write(payload))
+    print(f"   ✅ Wrote vector index {db_path / name} ({len(ids)} vectors)")
@@ -7,16 +7,36 @@ Then it will be available at http://localhost:8000/retrieve
 
 import os
 import json
+from collections import OrderedDict
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+import numpy as np
 import chromadb
 from chromadb.config import Settings
-import google.generativeai as genai
+import httpx
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+EMBEDDING_MODEL = os.getenv("GEMINI_EMBED_MODEL", "models/embedding-001")
+DB_PATH = "./chroma_db"
+COLLECTION_NAME = "experience_store"
+# One mean-pooled embedding per experience; queried first so no over-fetching is needed
+SUMMARY_COLLECTION_NAME = "experience_summary"
+# NumPy shadow index written by ingest.py; searched in memory, ChromaDB is the fallback
+INDEX_PATH = os.path.join(DB_PATH, "experience_index.npy")
+INDEX_META_PATH = os.path.join(DB_PATH, "experience_index.json")
+# STAR text per experience_id, written by ingest.py instead of storing it on every chunk
+STAR_PATH = os.path.join(DB_PATH, "star_by_id.json")
+QUERY_CACHE_SIZE = 1024  # Query embeddings kept in memory (LRU)
 
 app = FastAPI()
 
+# Normalized query -> embedding, most recently used last. Lives for the process lifetime.
+query_embedding_cache = OrderedDict()
+
 # Enable CORS for Next.js frontend
 app.add_middleware(
     CORSMiddleware,
@@ -29,7 +49,7 @@ app.add_middleware(
 
 class RetrieveRequest(BaseModel):
     query: str
-    top_k: int = 5  # Number of experiences to retrieve
+    top_k: int = Field(5, ge=1)  # Number of experiences to retrieve
 
 
 class Experience(BaseModel):
@@ -40,103 +60,289 @@ class Experience(BaseModel):
 
 
 class RetrieveResponse(BaseModel):
+    """Response schema for /retrieve (documentation only; the endpoint returns ORJSONResponse directly)."""
     experiences: List[Experience]
 
 
-def get_embedding(text: str, api_key: str) -> list:
-    """Generate embedding using Gemini's embedding model."""
-    genai.configure(api_key=api_key)
+def open_collection(state) -> None:
+    """Open the ChromaDB client and collection, recording any error on state."""
+    if not os.path.exists(DB_PATH):
+        state.db_error = "ChromaDB not initialized. Please run ingest.py first."
+        return
+    
     try:
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=text,
-            task_type="retrieval_query" if "query" in text.lower() else "retrieval_document"
-        )
-        return result['embedding']
+        state.client = chromadb.PersistentClient(path=DB_PATH)
+        state.collection = state.client.get_collection(name=COLLECTION_NAME)
+        state.db_error = None
     except Exception as e:
+        state.db_error = f"Error accessing ChromaDB: {str(e)}"
+        return
+    
+    # Optional: collections ingested before summaries existed don't have it
+    try:
+        state.summary_collection = state.client.get_collection(name=SUMMARY_COLLECTION_NAME)
+    except Exception:
+        state.summary_collection = None
+
+
+def file_mtime(path: str) -> Optional[int]:
+    """Return the modification time of a file in nanoseconds, or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_vector_index(state) -> None:
+    """(Re)load the NumPy shadow index written by ingest.py if it changed since the last load."""
+    # ingest.py replaces the metadata file last, so its mtime marks a complete index
+    mtime = file_mtime(INDEX_META_PATH)
+    if mtime is None or mtime == state.index_mtime:
+        return
+    
+    try:
+        # Loaded into memory (a few KB per hundred experiences) rather than
+        # memory-mapped, so re-ingesting can never pull pages out from under us
+        # Stored as float16; upcast once so every query runs a BLAS float32 matmul
+        embeddings = np.load(INDEX_PATH).astype(np.float32)
+        with open(INDEX_META_PATH, "r", encoding="utf-8") as f:
+            metadatas = json.load(f)["metadatas"]
+    except Exception as e:
+        print(f"⚠️  Could not load vector index, falling back to ChromaDB: {e}")
+        return
+    
+    if len(embeddings) != len(metadatas):
+        # Caught between two ingest writes; retried on the next request
+        return
+    
+    # Swapped in as one tuple so concurrent requests never mix old and new parts
+    state.vector_index = (embeddings, metadatas)
+    state.index_mtime = mtime
+
+
+def load_star_texts(state) -> None:
+    """(Re)load the STAR text for every experience, keyed by experience_id, if the file changed."""
+    mtime = file_mtime(STAR_PATH)
+    if mtime is None or mtime == state.star_mtime:
+        return
+    
+    try:
+        with open(STAR_PATH, "r", encoding="utf-8") as f:
+            state.star_by_id = json.load(f)
+        state.star_mtime = mtime
+    except Exception as e:
+        print(f"⚠️  Could not load STAR texts: {e}")
+
+
+def open_stores(state) -> None:
+    """Load the vector index and STAR texts, and open ChromaDB."""
+    load_vector_index(state)
+    load_star_texts(state)
+    open_collection(state)
+
+
+def search_vector_index(embeddings, query_embedding: list, n_results: int):
+    """
+    Inner-product search over the L2-normalized float32 index.
+    
+    Returns:
+        Row indices of the n_results best matches, best first
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm > 0:
+        query /= norm
+    
+    n_results = min(n_results, len(embeddings))
+    if n_results == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    scores = embeddings @ query
+    top = np.argpartition(-scores, n_results - 1)[:n_results]
+    return top[np.argsort(-scores[top])]
+
+
+@app.on_event("startup")
+def startup():
+    """Load the vector index and create the ChromaDB and HTTP clients once per process."""
+    # Shared HTTP/2 client so Gemini calls reuse pooled keep-alive connections
+    # instead of paying a TLS handshake per query. Closed on shutdown.
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32),
+        timeout=30.0,
+    )
+    app.state.vector_index = None
+    app.state.index_mtime = None
+    app.state.star_by_id = {}
+    app.state.star_mtime = None
+    app.state.client = None
+    app.state.collection = None
+    app.state.summary_collection = None
+    app.state.db_error = None
+    
+    open_stores(app.state)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared HTTP client."""
+    await app.state.http_client.aclose()
+
+
+async def embed_content(http_client, body: dict) -> list:
+    """POST an embedContent request to Gemini over the shared client."""
+    response = await http_client.post(
+        f"{GEMINI_API_BASE}/{EMBEDDING_MODEL}:embedContent",
+        headers={"x-goog-api-key": os.getenv("GEMINI_API_KEY", "")},
+        json=body,
+    )
+    response.raise_for_status()
+    return response.json()['embedding']['values']
+
+
+async def get_query_embedding(http_client, text: str):
+    """
+    Generate a query embedding using Gemini's embedding model without blocking the event loop.
+    
+    Returns:
+        Tuple of (embedding, whether it was generated with the RETRIEVAL_QUERY task type)
+    """
+    body = {
+        "model": EMBEDDING_MODEL,
+        "content": {"parts": [{"text": text}]},
+    }
+    try:
+        return await embed_content(http_client, {**body, "taskType": "RETRIEVAL_QUERY"}), True
+    except httpx.HTTPStatusError as e:
+        # Only a rejected request (4xx) suggests the model doesn't take a task
+        # type; timeouts, 429 and 5xx are reported to the client instead
+        if not 400 <= e.response.status_code < 500 or e.response.status_code == 429:
+            raise Exception(f"Error generating embedding: {e}")
         # Try alternative API format
         try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=text
-            )
-            return result['embedding']
+            return await embed_content(http_client, body), False
         except Exception as e2:
             raise Exception(f"Error generating embedding: {e2}")
 
 
-@app.post("/retrieve", response_model=RetrieveResponse)
-async def retrieve_experiences(request: RetrieveRequest):
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups (case and whitespace insensitive)."""
+    return " ".join(query.lower().split())
+
+
+async def get_cached_query_embedding(http_client, query: str) -> list:
+    """Return the query embedding, calling Gemini only on a cache miss."""
+    key = normalize_query(query)
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        query_embedding_cache.move_to_end(key)
+        return embedding
+    
+    embedding, with_task_type = await get_query_embedding(http_client, query)
+    # Fallback embeddings (no task type) are used for this request but not cached
+    if with_task_type:
+        query_embedding_cache[key] = embedding
+        if len(query_embedding_cache) > QUERY_CACHE_SIZE:
+            query_embedding_cache.popitem(last=False)
+    return embedding
+
+
+async def query_metadatas(collection, query_embedding: list, n_results: int) -> list:
+    """Query a ChromaDB collection off the event loop and return the matched metadatas."""
+    count = await run_in_threadpool(collection.count)
+    if count == 0:
+        return []
+    
+    results = await run_in_threadpool(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=min(n_results, count),
+        include=["metadatas"]
+    )
+    return results['metadatas'][0] if results['metadatas'] else []
+
+
+@app.post("/retrieve", response_model=RetrieveResponse, response_class=ORJSONResponse)
+async def retrieve_experiences(request: RetrieveRequest, http_request: Request):
     """Retrieve relevant experiences based on query."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+    if not os.getenv("GEMINI_API_KEY"):
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
     
-    # Initialize ChromaDB
-    db_path = "./chroma_db"
-    if not os.path.exists(db_path):
-        raise HTTPException(
-            status_code=500,
-            detail="ChromaDB not initialized. Please run ingest.py first."
-        )
-    
-    try:
-        client = chromadb.PersistentClient(path=db_path)
-        collection = client.get_collection(name="experience_store")
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error accessing ChromaDB: {str(e)}"
-        )
+    # Reuse the stores opened at startup; retry if ingest ran afterwards
+    state = http_request.app.state
+    if state.vector_index is None and state.collection is None:
+        await run_in_threadpool(open_stores, state)
+        if state.vector_index is None and state.collection is None:
+            raise HTTPException(status_code=500, detail=state.db_error)
     
     # Generate embedding for query
     try:
-        query_embedding = get_embedding(request.query, api_key)
+        query_embedding = await get_cached_query_embedding(state.http_client, request.query)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating query embedding: {str(e)}"
         )
     
-    # Query ChromaDB - retrieve more chunks to account for deduplication
-    # We'll retrieve top_k * 3 chunks, then deduplicate by experience_id
-    try:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(request.top_k * 3, collection.count())
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error querying ChromaDB: {str(e)}"
-        )
-    
-    # Format results and deduplicate by experience_id
-    experiences = []
-    seen_experience_ids = set()
+    # Pick up an index and STAR texts rewritten by a later ingest without a restart
+    if file_mtime(INDEX_META_PATH) != state.index_mtime:
+        await run_in_threadpool(load_vector_index, state)
+    if file_mtime(STAR_PATH) != state.star_mtime:
+        await run_in_threadpool(load_star_texts, state)
     
-    if results['ids'] and len(results['ids'][0]) > 0:
-        for i, chunk_id in enumerate(results['ids'][0]):
-            metadata = results['metadatas'][0][i]
-            experience_id = metadata.get('experience_id', metadata.get('id'))
-            
-            # Skip if we've already seen this experience
-            if experience_id in seen_experience_ids:
-                continue
-            
-            # Only add if we haven't reached the requested number
-            if len(experiences) >= request.top_k:
-                break
+    vector_index = state.vector_index
+    if vector_index is not None:
+        # The in-memory index holds one summary vector per experience,
+        # so top_k rows are top_k distinct experiences (sub-millisecond at this scale)
+        embeddings, metadatas = vector_index
+        try:
+            rows = search_vector_index(embeddings, query_embedding, request.top_k)
+        except Exception as e:
+            # e.g. GEMINI_EMBED_MODEL differs from the one the index was built with
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error searching vector index: {str(e)}"
+            )
+        candidates = [metadatas[i] for i in rows]
+    else:
+        try:
+            candidates = []
+            if state.summary_collection is not None:
+                candidates = await query_metadatas(
+                    state.summary_collection, query_embedding, request.top_k
+                )
             
-            seen_experience_ids.add(experience_id)
-            experiences.append(Experience(
-                id=experience_id,
-                title=metadata['title'],
-                company=metadata['company'],
-                star_format=metadata['star_format']
-            ))
-    
-    return RetrieveResponse(experiences=experiences)
+            # Fall back to chunks, retrieving top_k * 3 to account for deduplication
+            if len(candidates) < request.top_k:
+                candidates = await query_metadatas(
+                    state.collection, query_embedding, request.top_k * 3
+                )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error querying ChromaDB: {str(e)}"
+            )
+    
+    # Deduplicate by experience_id (only chunk results can repeat), keeping
+    # the first, best-ranked chunk of each experience
+    seen = {}
+    for metadata in candidates:
+        seen.setdefault(metadata.get('experience_id', metadata.get('id')), metadata)
+    
+    experiences = [
+        {
+            "id": experience_id,
+            "title": metadata['title'],
+            "company": metadata['company'],
+            # JSON object keys are strings; older ingests kept STAR on the metadata
+            "star_format": state.star_by_id.get(str(experience_id), metadata.get('star_format', '')),
+        }
+        for experience_id, metadata in list(seen.items())[:request.top_k]
+    ]
+    
+    # Returning the response directly skips response_model re-validation
+    return ORJSONResponse({"experiences": experiences})
 
 
 @app.get("/health")